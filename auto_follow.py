@@ -1,40 +1,53 @@
 import asyncio
 import json
+import logging
 import os
+from collections.abc import Iterator
+from operator import itemgetter
 from typing import Any
-import toml  # 导入 toml 库
 
 from bilibili_api import Credential, user, sync
 from bilibili_api.user import RelationType
 from bilibili_api.exceptions import ResponseCodeException
+from bilibili_api.utils.network import Api
 
-CONFIG_FILE = "config.toml"
+from common import (
+    RATE_LIMIT_CODES,
+    RATE_LIMIT_DELAY,
+    RateLimiter,
+    json_loads,
+    load_config,
+    setup_logging,
+    use_shared_session,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# 进度文件名模板，按操作账号的 UID 区分，每行一个已处理完成的 UID，用于中断后继续
+STATE_FILE_TEMPLATE = ".follow_state_{uid}.txt"
+
+# 重试也无法成功的错误码（用户不存在、不能关注自己、黑名单限制等）
+PERMANENT_ERROR_CODES = {-404, 22001, 22002, 22003}
+# 凭证失效的错误码（账号未登录、csrf 校验失败），重试或继续关注其他用户均无法成功
+FATAL_ERROR_CODES = {-101, -111}
+
+# 批量查询与多个用户关系的接口，单次最多 50 个 UID
+RELATIONS_API = {
+    "url": "https://api.bilibili.com/x/relation/relations",
+    "method": "GET",
+    "verify": True,
+}
+RELATIONS_BATCH_SIZE = 50
+
+RELATION_SUBSCRIBE = RelationType.SUBSCRIBE
+
+get_mid = itemgetter("mid")
+
+
+class CredentialError(Exception):
+    """操作用户的凭证失效，无法继续关注。"""
 
-def load_config() -> dict[str, Any] | None:
-    """加载配置文件。"""
-    try:
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            config = toml.load(f)
-        # 验证 auto_follow_credential 部分是否存在且包含必要项
-        auto_follow_cred = config.get('auto_follow_credential', {})
-        if not all(k in auto_follow_cred for k in ['sessdata', 'bili_jct', 'uid']):
-            print(f"错误：配置文件 {CONFIG_FILE} 缺少 [auto_follow_credential] 部分或其必要的 sessdata, bili_jct, uid 配置项。")
-            return None
-        # 验证必要项的值不为空
-        if not auto_follow_cred['sessdata'] or not auto_follow_cred['bili_jct'] or auto_follow_cred['uid'] == 0:
-            print(f"错误：配置文件 {CONFIG_FILE} 中 [auto_follow_credential] 的 sessdata, bili_jct 或 uid 不能为空或为0。请填充有效值。")
-            return None
-        print(f"成功从 {os.path.abspath(CONFIG_FILE)} 加载配置。")
-        return config
-    except FileNotFoundError:
-        print(f"错误：配置文件 {CONFIG_FILE} 未找到。请确保配置文件存在于脚本同级目录。")
-        return None
-    except toml.TomlDecodeError as e:
-        print(f"错误：解析配置文件 {CONFIG_FILE} 失败: {e}")
-        return None
-    except Exception as e:
-        print(f"加载配置文件时发生未知错误: {e}")
-        return None
 
 def load_followings_from_json(
     filename: str = "followings.json",
@@ -48,64 +61,181 @@ def load_followings_from_json(
         list[dict[str, Any]] | None: 包含关注用户信息的列表，如果文件不存在或解析失败则返回 None。
     """
     if not os.path.exists(filename):
-        print(f"错误：文件 {filename} 不存在。请先运行 main.py 导出关注列表。")
+        logger.error(f"错误：文件 {filename} 不存在。请先运行 main.py 导出关注列表。")
         return None
     try:
-        with open(filename, "r", encoding="utf-8") as f:
-            followings = json.load(f)
+        with open(filename, "rb") as f:
+            data = f.read()
+        followings = json_loads(data)
         if not isinstance(followings, list):
-            print(f"错误：文件 {filename} 格式不正确，应为 JSON 列表。")
+            logger.error(f"错误：文件 {filename} 格式不正确，应为 JSON 列表。")
             return None
-        print(
+        logger.info(
             f"成功从 {os.path.abspath(filename)} 加载 {len(followings)} 个待关注用户。"
         )
         return followings
-    except json.JSONDecodeError as e:
-        print(f"解析 JSON 文件时出错: {e}")
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        logger.error(f"解析 JSON 文件时出错: {e}")
         return None
     except IOError as e:
-        print(f"读取文件时出错: {e}")
+        logger.error(f"读取文件时出错: {e}")
         return None
 
 
-async def follow_user(target_uid: int, credential: Credential) -> bool:
-    """关注指定 UID 的用户。
+def iter_valid_uids(items: list[Any]) -> Iterator[int]:
+    """从关注列表条目中提取有效的 UID。
+
+    格式不正确或 UID 无效的条目会被跳过，并在遍历结束后汇总输出一条警告。
 
     Args:
-        target_uid (int): 目标用户的 UID。
-        credential (Credential): 操作用户的认证凭证。
+        items (list[Any]): 从 JSON 文件加载的关注列表条目。
+
+    Yields:
+        int: 有效的 UID。
+    """
+    # 只记录跳过的数量和第一个无效条目，避免在大列表中缓存所有无效数据
+    skipped = 0
+    first_skipped: Any = None
+    for item in items:
+        uid = None
+        if isinstance(item, dict) and "mid" in item:
+            try:
+                uid = int(get_mid(item))
+            except (ValueError, TypeError):
+                pass
+        if uid is not None:
+            yield uid
+            continue
+        if not skipped:
+            first_skipped = item
+        skipped += 1
+    if skipped:
+        logger.warning(
+            f"警告：跳过 {skipped} 个格式不正确或 UID 无效的条目，例如: {first_skipped}"
+        )
+
+
+def load_follow_state(filename: str) -> set[int]:
+    """加载上次运行中已处理完成的 UID。
+
+    Args:
+        filename (str): 进度文件名。
 
     Returns:
-        bool: 操作是否成功。
+        set[int]: 已处理完成的 UID 集合，文件不存在时为空集合。
     """
+    processed: set[int] = set()
+    if not os.path.exists(filename):
+        return processed
     try:
-        u_target = user.User(uid=target_uid, credential=credential)
-        await u_target.modify_relation(relation=RelationType.SUBSCRIBE)
-        print(f"成功关注用户 UID: {target_uid}")
-        return True
+        with open(filename, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line.isdigit():
+                    processed.add(int(line))
+    except IOError as e:
+        logger.warning(f"读取进度文件 {filename} 时出错: {e}，将从头开始。")
+    return processed
+
+
+async def follow_user(
+    u_target: user.User, limiter: RateLimiter
+) -> tuple[bool, bool, float | None]:
+    """关注指定的用户。
+
+    Args:
+        u_target (user.User): 目标用户，需携带操作用户的认证凭证。
+        limiter (RateLimiter): 所有请求共享的限流器。
+
+    Returns:
+        tuple[bool, bool, float | None]: (操作是否成功, 失败时是否值得重试, 触发限流时建议的退避时间)。
+
+    Raises:
+        CredentialError: 凭证失效（未登录或 csrf 校验失败）时抛出。
+    """
+    target_uid = u_target.get_uid()
+    try:
+        await limiter.acquire()
+        await u_target.modify_relation(relation=RELATION_SUBSCRIBE)
+        logger.debug("成功关注用户 UID: %s", target_uid)
+        return True, False, None
     except ResponseCodeException as e:
         # 特殊处理 Bilibili API 可能返回的错误码
         if e.code == 22014:  # 已经关注了该用户
-            print(f"用户 UID: {target_uid} 已关注，跳过。")
-            return True  # 视为成功，因为目标状态已达成
-        elif e.code == -404:  # 用户不存在
-            print(f"用户 UID: {target_uid} 不存在，跳过。错误信息: {e}")
-            return False
+            logger.debug("用户 UID: %s 已关注，跳过。", target_uid)
+            return True, False, None  # 视为成功，因为目标状态已达成
+        elif e.code in FATAL_ERROR_CODES:
+            raise CredentialError(str(e)) from e
+        elif e.code in PERMANENT_ERROR_CODES:
+            logger.warning(f"关注用户 UID: {target_uid} 失败且无法重试，跳过。错误信息: {e}")
+            return False, False, None
+        elif e.code in RATE_LIMIT_CODES or "频繁" in str(e.msg):
+            # bilibili_api 不会暴露 Retry-After 响应头，使用固定的建议等待时间
+            logger.warning(f"关注用户 UID: {target_uid} 时触发限流: {e}")
+            return False, True, RATE_LIMIT_DELAY
         else:
-            print(f"关注用户 UID: {target_uid} 时发生 API 错误: {e}")
-            return False
+            logger.warning(f"关注用户 UID: {target_uid} 时发生 API 错误: {e}")
+            return False, True, None
     except Exception as e:
-        print(f"关注用户 UID: {target_uid} 时发生未知错误: {e}")
-        return False
+        logger.warning(f"关注用户 UID: {target_uid} 时发生未知错误: {e}")
+        return False, True, None
+
+
+async def get_followed_uids(
+    uids: list[int], credential: Credential, limiter: RateLimiter
+) -> set[int]:
+    """批量查询已关注的用户，每 50 个 UID 只需一次请求。
+
+    查询失败的批次会被忽略，其中的用户仍交由 follow_user 处理（已关注时返回 22014）。
+
+    Args:
+        uids (list[int]): 待查询的 UID 列表。
+        credential (Credential): 操作用户的认证凭证。
+        limiter (RateLimiter): 所有请求共享的限流器。
+
+    Returns:
+        set[int]: 其中已关注（含互相关注）的 UID 集合。
+    """
+    followed: set[int] = set()
+    for i in range(0, len(uids), RELATIONS_BATCH_SIZE):
+        batch = uids[i : i + RELATIONS_BATCH_SIZE]
+        batch_set = set(batch)
+        try:
+            await limiter.acquire()
+            relations = await (
+                Api(**RELATIONS_API, credential=credential)
+                .update_params(fids=",".join(map(str, batch)))
+                .result
+            )
+        except Exception as e:
+            logger.warning(f"批量检查关注关系时出错: {e}，该批用户将直接尝试关注。")
+            continue
+        for mid, info in (relations or {}).items():
+            # attribute=2 表示已关注, attribute=6 表示互相关注
+            if isinstance(info, dict) and info.get("attribute") in [2, 6]:
+                if int(mid) in batch_set:
+                    followed.add(int(mid))
+    return followed
 
 
 async def main() -> None:
-    """主函数，执行获取凭证、读取列表并自动关注的流程。"""
-    print("欢迎使用 Bilibili 自动关注工具！")
-    print("将根据 followings.json 文件中的列表进行关注操作。")
+    """主函数，在共享的 HTTP 会话中执行自动关注流程。"""
+    session = None
+    try:
+        session = await use_shared_session()
+        await run_auto_follow()
+    finally:
+        if session is not None:
+            await session.close()
+
+
+async def run_auto_follow() -> None:
+    """执行获取凭证、读取列表并自动关注的流程。"""
+    logger.info("欢迎使用 Bilibili 自动关注工具！")
+    logger.info("将根据 followings.json 文件中的列表进行关注操作。")
 
     # 加载配置
-    config = load_config()
+    config = await asyncio.to_thread(load_config, 'auto_follow_credential')
     if not config:
         return
 
@@ -127,110 +257,206 @@ async def main() -> None:
     # 实例化 Credential
     credential = Credential(sessdata=sessdata, bili_jct=bili_jct, buvid3=buvid3)
 
-    print("正在验证凭证并获取用户信息...")
+    logger.info("正在验证凭证并获取用户信息...")
     try:
         # 尝试获取用户信息以验证凭证有效性
         u_self = user.User(uid=int(my_uid), credential=credential)
         user_info = await u_self.get_user_info()
-        print(f"凭证有效，当前操作用户: {user_info.get('name', '未知')}")
+        logger.info(f"凭证有效，当前操作用户: {user_info.get('name', '未知')}")
     except Exception as e:
-        print(f"凭证无效或获取用户信息失败: {e}")
-        print("请检查您的 SESSDATA、bili_jct、buvid3 和 UID 是否正确且未过期。")
+        logger.error(f"凭证无效或获取用户信息失败: {e}")
+        logger.error("请检查您的 SESSDATA、bili_jct、buvid3 和 UID 是否正确且未过期。")
         return
 
     # 加载关注列表
-    followings_to_add = load_followings_from_json()
+    followings_to_add = await asyncio.to_thread(load_followings_from_json)
     if not followings_to_add:
-        print("无法加载关注列表，程序退出。")
+        logger.error("无法加载关注列表，程序退出。")
         return
 
-    # 提取需要关注的 UID 列表
-    uids_to_follow: list[int] = []
-    for item in followings_to_add:
-        if isinstance(item, dict) and "mid" in item:
-            try:
-                uids_to_follow.append(int(item["mid"]))
-            except (ValueError, TypeError):
-                print(f"警告：跳过无效的 UID 数据: {item}")
-        else:
-            print(f"警告：跳过格式不正确的条目: {item}")
+    # 提取需要关注的 UID 列表，去重以免重复请求，并按 UID 排序：
+    # 每批关系查询覆盖相邻的 UID 区间，关注顺序也因此按 UID 而非文件中的顺序
+    valid_uids = list(iter_valid_uids(followings_to_add))
+    uids_to_follow: list[int] = sorted(set(valid_uids))
+    if len(valid_uids) > len(uids_to_follow):
+        logger.info(f"已去除 {len(valid_uids) - len(uids_to_follow)} 个重复的 UID。")
 
     if not uids_to_follow:
-        print("没有有效的 UID 需要关注。")
+        logger.warning("没有有效的 UID 需要关注。")
         return
 
-    print(f"准备开始关注 {len(uids_to_follow)} 个用户...")
-    successful_follows = 0
-    failed_follows = 0
-    # 设置关注间隔和重试参数
-    follow_interval: int = 3  # 每次关注后的常规等待时间（秒）
+    # 跳过上次运行中已处理完成的 UID
+    # 进度按操作账号区分，切换账号后不会跳过另一个账号处理过的 UID
+    state_filename = STATE_FILE_TEMPLATE.format(uid=int(my_uid))
+    processed = await asyncio.to_thread(load_follow_state, state_filename)
+    if processed:
+        total_uids = len(uids_to_follow)
+        uids_to_follow = [uid for uid in uids_to_follow if uid not in processed]
+        logger.info(
+            f"从进度文件 {state_filename} 中恢复，跳过 {total_uids - len(uids_to_follow)} 个已处理的用户。"
+        )
+        if not uids_to_follow:
+            logger.info("所有用户均已处理完成。如需重新处理，请删除进度文件。")
+            return
+
+    logger.info(f"准备开始关注 {len(uids_to_follow)} 个用户...")
+    # 设置并发和重试参数
+    concurrency: int = 8  # 同时进行关注操作的最大用户数
+    rate_limit: int = 30  # 每个时间窗口内允许的最大请求数
+    rate_window: float = 10  # 限流时间窗口（秒）
     max_retries: int = 10  # 单个用户最大重试次数
-    retry_interval: int = 10  # 失败后重试的等待时间（秒）
+    retry_interval: float = 10  # 非限流错误的重试等待时间（秒）
+    retry_max_delay: float = 120  # 限流时指数退避的最大等待时间（秒）
+    retry_jitter: float = 1  # 每次重试附加的随机抖动上限（秒）
+    progress_interval: int = 50  # 每处理完多少个用户输出一次进度
+    state_flush_size: int = 20  # 每累计多少个已处理的 UID 写入一次进度文件
 
-    for target_uid in uids_to_follow:
-        try:
-            # 预检查是否已关注
-            u_target_check = user.User(uid=target_uid, credential=credential)
-            relation_info = await u_target_check.get_relation()
-            # attribute=2 表示已关注, attribute=6 表示互相关注
-            if relation_info.get("relation").get("attribute") in [2, 6]:
-                print(f"用户 UID: {target_uid} 已关注，跳过。")
-                successful_follows += 1  # 视为成功
-                await asyncio.sleep(0.5)  # 短暂等待避免日志刷屏
-                continue  # 处理下一个 UID
-        except ResponseCodeException as e:
-            if e.code == -404:  # 用户不存在
-                print(
-                    f"检查关系时发现用户 UID: {target_uid} 不存在，跳过。错误信息: {e}"
-                )
-                failed_follows += 1
-                await asyncio.sleep(0.5)
-                continue
-            else:
-                print(
-                    f"检查用户 UID: {target_uid} 关系时发生 API 错误: {e}，将尝试直接关注。"
-                )
-        except Exception as e:
-            print(
-                f"检查用户 UID: {target_uid} 关系时发生未知错误: {e}，将尝试直接关注。"
-            )
+    sem = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate_limit, rate_window)
+    # 以追加模式打开进度文件，文件操作均在线程中执行
+    # 已处理的 UID 先缓存在内存中，攒够一批再写入；进程被强制结束时最多丢失一批，
+    # 下次运行会重新处理这些 UID，已关注的用户不会重复关注
+    state_file = await asyncio.to_thread(open, state_filename, "a", encoding="utf-8")
+    pending_state: list[int] = []
+    state_write: asyncio.Future[None] | None = None
+
+    def _write_state(lines: str) -> None:
+        state_file.write(lines)
+        state_file.flush()
+
+    def _mark_done(*uids: int) -> None:
+        pending_state.extend(uids)
 
-        # 如果未关注或检查出错，则尝试关注和重试
+    async def _flush_state() -> None:
+        """将缓存的 UID 写入进度文件。
+
+        写入线程受 shield 保护，调用方被取消时写入仍会完成，关闭文件前需等待 state_write 结束。
+        """
+        nonlocal state_write
+        if state_write is not None:
+            await asyncio.wait([state_write])
+        if not pending_state:
+            return
+        lines = "".join(f"{uid}\n" for uid in pending_state)
+        pending_state.clear()
+        state_write = asyncio.ensure_future(asyncio.to_thread(_write_state, lines))
+        await asyncio.shield(state_write)
+
+    async def _process(target_uid: int) -> bool:
+        """带重试地关注单个 UID。
+
+        Args:
+            target_uid (int): 目标用户的 UID。
+
+        Returns:
+            bool: 该用户最终是否处于已关注状态。
+
+        Raises:
+            CredentialError: 凭证失效时抛出，由调用方停止全部任务。
+        """
+        u_target = user.User(uid=target_uid, credential=credential)
+        # 已关注的用户已在批量预检查中排除，follow_user 内部也会处理已关注的情况
         retries = 0
         while retries <= max_retries:
-            print(
-                f"尝试关注 UID: {target_uid} (尝试次数: {retries + 1}/{max_retries + 1})..."
-            )
-            # 注意：follow_user 内部也处理了已关注的情况，但预检查可以减少不必要的调用
-            success = await follow_user(target_uid, credential)
+            # 只在请求期间占用并发名额，等待重试时释放给其他用户
+            async with sem:
+                logger.debug(
+                    "尝试关注 UID: %s (尝试次数: %d/%d)...", target_uid, retries + 1, max_retries + 1
+                )
+                success, retryable, rate_limit_delay = await follow_user(
+                    u_target, limiter
+                )
             if success:
-                # 如果 follow_user 返回 True 但之前检查未发现已关注，则计入成功
-                # 如果 follow_user 返回 True 因为内部判断已关注，这里不会重复计数（因为预检查continue了）
-                if relation_info.get("attribute") not in [2, 6]:
-                    successful_follows += 1
-                print(f"等待 {follow_interval} 秒后继续下一个用户...")
-                await asyncio.sleep(follow_interval)
-                break  # 成功则跳出重试循环，处理下一个UID
+                limiter.reset_backoff()
+                _mark_done(target_uid)
+                return True
+            if not retryable:
+                _mark_done(target_uid)
+                return False
+            retries += 1
+            if retries > max_retries:
+                break
+            if rate_limit_delay is not None:
+                # 触发限流时暂停共享限流器，所有任务共用同一退避等级一起指数退避
+                delay = limiter.backoff(rate_limit_delay, retry_max_delay, retry_jitter)
+                logger.warning(f"触发限流，所有请求将暂停 {delay:.1f} 秒...")
             else:
-                # follow_user 返回 False 的情况 (非已关注导致的成功)
-                retries += 1
-                if retries <= max_retries:
-                    print(f"关注失败，将在 {retry_interval} 秒后重试...")
-                    await asyncio.sleep(retry_interval)
+                logger.warning(
+                    f"关注 UID: {target_uid} 失败，将在 {retry_interval} 秒后重试..."
+                )
+                await asyncio.sleep(retry_interval)
+        # 重试耗尽的用户不写入进度文件，下次运行时会再次尝试
+        logger.warning(
+            f"尝试 {max_retries + 1} 次后关注 UID: {target_uid} 仍然失败，跳过此用户。"
+        )
+        return False
+
+    try:
+        logger.info("正在批量检查已关注的用户...")
+        already_followed = await get_followed_uids(uids_to_follow, credential, limiter)
+        if already_followed:
+            logger.info(f"{len(already_followed)} 个用户已关注，跳过。")
+            _mark_done(*already_followed)
+        pending_uids = [uid for uid in uids_to_follow if uid not in already_followed]
+
+        successful_follows = len(already_followed)  # 已关注的用户视为成功
+        failed_follows = 0
+        unprocessed = 0
+        # 按完成顺序汇总结果，定期输出一行进度而不是逐个用户输出日志
+        tasks = [asyncio.create_task(_process(uid)) for uid in pending_uids]
+        for done, future in enumerate(asyncio.as_completed(tasks), start=1):
+            try:
+                if await future:
+                    successful_follows += 1
                 else:
-                    print(
-                        f"尝试 {max_retries + 1} 次后关注 UID: {target_uid} 仍然失败，跳过此用户。"
-                    )
                     failed_follows += 1
-                    # 即使重试失败，也等待常规间隔再处理下一个用户，避免对API造成连续压力
-                    print(f"等待 {follow_interval} 秒后继续下一个用户...")
-                    await asyncio.sleep(follow_interval)
-                    break  # 达到最大重试次数，跳出重试循环
+            except CredentialError as e:
+                # 凭证失效时其余用户也无法关注，立即停止全部任务
+                logger.error(f"凭证已失效，停止关注: {e}")
+                logger.error("请检查您的 SESSDATA、bili_jct、buvid3 和 UID 是否正确且未过期。")
+                for task in tasks:
+                    task.cancel()
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+                # 部分任务可能已完成但尚未被计入，按全部任务的结果重新统计
+                successful_follows = len(already_followed) + sum(r is True for r in results)
+                failed_follows = sum(
+                    r is False or (isinstance(r, Exception) and not isinstance(r, CredentialError))
+                    for r in results
+                )
+                unprocessed = len(tasks) - (successful_follows - len(already_followed)) - failed_follows
+                break
+            except Exception as e:
+                logger.error(f"处理用户时发生未处理的异常: {e}")
+                failed_follows += 1
+            if len(pending_state) >= state_flush_size:
+                await _flush_state()
+            if done % progress_interval == 0 or done == len(tasks):
+                logger.info(
+                    f"进度: {done}/{len(tasks)}，成功 {successful_follows}，失败 {failed_follows}"
+                )
+    finally:
+        try:
+            await _flush_state()
+        finally:
+            # 等待仍在线程中进行的写入结束后再关闭文件
+            if state_write is not None:
+                await asyncio.wait([state_write])
+            await asyncio.to_thread(state_file.close)
 
-    print("\n关注操作完成！")
-    print(f"成功关注: {successful_follows} 个用户")
-    print(f"失败或跳过: {failed_follows} 个用户")
+    if unprocessed:
+        # 未处理的用户不会写入进度文件，更新凭证后重新运行即可继续
+        logger.error(
+            f"关注操作已提前停止：{len(pending_uids)} 个待关注用户中有 {unprocessed} 个未处理。"
+        )
+    else:
+        logger.info("关注操作完成！")
+    logger.info(f"成功关注: {successful_follows} 个用户")
+    logger.info(f"失败或跳过: {failed_follows} 个用户")
 
 
 if __name__ == "__main__":
-    sync(main())
+    log_listener = setup_logging()
+    try:
+        sync(main())
+    finally:
+        log_listener.stop()
@@ -0,0 +1,209 @@
+import asyncio
+import copy
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import tomllib
+from collections import deque
+from typing import Any
+
+try:
+    import orjson  # 可选依赖，安装后可加速 JSON 读写
+except ImportError:
+    orjson = None
+
+import aiohttp
+from bilibili_api import get_client, select_client, set_session
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILE = "config.toml"
+
+# 表示请求过于频繁的错误码，应退避后重试
+RATE_LIMIT_CODES = {-412, -509, -799}
+# 触发限流后建议的最短等待时间（秒）
+RATE_LIMIT_DELAY: float = 30
+
+
+def json_loads(data: bytes) -> Any:
+    """解析 JSON 字节串，已安装 orjson 时使用 orjson。"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj: Any) -> bytes:
+    """将对象序列化为 UTF-8 编码的 JSON 字节串，已安装 orjson 时使用 orjson。"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_toml(path: str, mtime: float, size: int) -> dict[str, Any]:
+    """解析 TOML 文件，按 (路径, 修改时间, 文件大小) 缓存，文件未变化时无需重新解析。"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return tomllib.loads(data.decode('utf-8'))
+
+
+def load_config(section: str) -> dict[str, Any] | None:
+    """加载配置文件，并验证指定的凭证部分。
+
+    Args:
+        section (str): 需要验证的凭证部分名称，如 auto_follow_credential。
+
+    Returns:
+        dict[str, Any] | None: 解析后的完整配置，文件不存在、解析失败或验证不通过时返回 None。
+    """
+    try:
+        st = os.stat(CONFIG_FILE)
+        # 缓存中的字典会被多次返回，复制一份以免调用方的修改影响缓存
+        config = copy.deepcopy(_parse_toml(CONFIG_FILE, st.st_mtime, st.st_size))
+        # 验证凭证部分是否存在且包含必要项
+        cred = config.get(section, {})
+        if not all(k in cred for k in ['sessdata', 'bili_jct', 'uid']):
+            logger.error(f"错误：配置文件 {CONFIG_FILE} 缺少 [{section}] 部分或其必要的 sessdata, bili_jct, uid 配置项。")
+            return None
+        # 验证必要项的值不为空
+        if not cred['sessdata'] or not cred['bili_jct'] or cred['uid'] == 0:
+            logger.error(f"错误：配置文件 {CONFIG_FILE} 中 [{section}] 的 sessdata, bili_jct 或 uid 不能为空或为0。请填充有效值。")
+            return None
+        logger.info(f"成功从 {os.path.abspath(CONFIG_FILE)} 加载配置。")
+        return config
+    except FileNotFoundError:
+        logger.error(f"错误：配置文件 {CONFIG_FILE} 未找到。请确保配置文件存在于脚本同级目录。")
+        return None
+    except tomllib.TOMLDecodeError as e:
+        logger.error(f"错误：解析配置文件 {CONFIG_FILE} 失败: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"加载配置文件时发生未知错误: {e}")
+        return None
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """配置日志输出，日志级别由环境变量 LOG_LEVEL 指定（默认 INFO）。
+
+    日志记录先放入队列，由后台线程写入标准输出（与原先的 print 输出保持一致），避免在关注任务中阻塞事件循环。
+
+    Returns:
+        logging.handlers.QueueListener: 已启动的日志监听器，程序结束前需调用 stop()。
+    """
+    log_queue: queue.Queue[logging.LogRecord] = queue.Queue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    level_name = os.environ.get("LOG_LEVEL", "INFO").upper()
+    level = logging.getLevelNamesMapping().get(level_name)
+    root.setLevel(logging.INFO if level is None else level)
+    listener.start()
+    if level is None:
+        logger.warning(f"无效的日志级别 LOG_LEVEL={level_name}，已使用 INFO。")
+    return listener
+
+
+class RateLimiter:
+    """滑动窗口限流器，限制所有并发任务在时间窗口内的总请求数。"""
+
+    def __init__(self, max_requests: int, window_seconds: float) -> None:
+        """
+        Args:
+            max_requests (int): 时间窗口内允许的最大请求数。
+            window_seconds (float): 时间窗口长度（秒）。
+        """
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self._requests: deque[float] = deque()
+        self._paused_until: float = 0
+        self._backoff_level: int = 0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """暂停所有请求，在此期间调用 acquire() 的任务都会等待。
+
+        用于触发服务端限流后让所有并发任务一起退避。重复调用时取最晚的结束时间。
+
+        Args:
+            seconds (float): 暂停时长（秒）。
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def backoff(self, base_delay: float, max_delay: float, jitter: float = 0) -> float:
+        """触发服务端限流时调用，暂停所有请求，暂停时长随连续限流次数指数增长。
+
+        暂停期间再次触发（通常来自暂停前已发出的请求）不会继续加倍，
+        只有暂停结束后仍被限流才会升级退避等级。
+
+        Args:
+            base_delay (float): 首次限流的暂停时长（秒）。
+            max_delay (float): 暂停时长的上限（秒）。
+            jitter (float, optional): 附加的随机抖动上限（秒）. Defaults to 0.
+
+        Returns:
+            float: 距离暂停结束的剩余时间（秒）。
+        """
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        delay = min(max_delay, base_delay * 2**self._backoff_level) + random.uniform(0, jitter)
+        self._backoff_level += 1
+        self.pause(delay)
+        return delay
+
+    def reset_backoff(self) -> None:
+        """请求成功后调用，将退避等级恢复为初始值。"""
+        self._backoff_level = 0
+
+    async def acquire(self) -> None:
+        """等待直到可以发出下一个请求，并记录本次请求时间。"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                # 移除已滑出时间窗口的请求记录
+                while self._requests and self._requests[0] <= now - self.window_seconds:
+                    self._requests.popleft()
+                if len(self._requests) < self.max_requests:
+                    break
+                await asyncio.sleep(self._requests[0] + self.window_seconds - now)
+            self._requests.append(now)
+
+
+async def use_shared_session(limit: int = 64, limit_per_host: int = 8) -> aiohttp.ClientSession:
+    """为 bilibili_api 设置一个在当前事件循环内共享的 aiohttp 会话。
+
+    所有 API 请求复用同一个连接池并缓存 DNS 解析结果，避免重复建立 TCP/TLS 连接。
+    需在事件循环中调用，使用完毕后应关闭返回的会话。
+
+    Args:
+        limit (int, optional): 连接池的最大连接数. Defaults to 64.
+        limit_per_host (int, optional): 同一主机的最大连接数. Defaults to 8.
+
+    Returns:
+        aiohttp.ClientSession: 已交给 bilibili_api 使用的会话。
+    """
+    select_client("aiohttp")
+    # set_session 只能替换当前事件循环中已存在的客户端的会话，
+    # 因此先让 bilibili_api 创建默认客户端，并关闭其自带的会话
+    await get_client().close()
+    connector = aiohttp.TCPConnector(
+        limit=limit, limit_per_host=limit_per_host, ttl_dns_cache=300
+    )
+    session = aiohttp.ClientSession(connector=connector, trust_env=True)
+    try:
+        set_session(session)
+    except BaseException:
+        await session.close()
+        raise
+    return session
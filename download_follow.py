@@ -1,96 +1,185 @@
 import asyncio
-import json
+import contextlib
+import logging
+import math
 import os
+from collections.abc import AsyncIterator
 from typing import Any
-import toml  # 导入 toml 库
 
 from bilibili_api import Credential, user, sync
+from bilibili_api.exceptions import ResponseCodeException
 
-CONFIG_FILE = "config.toml"
+from common import (
+    RATE_LIMIT_CODES,
+    RATE_LIMIT_DELAY,
+    RateLimiter,
+    json_dumps,
+    load_config,
+    setup_logging,
+    use_shared_session,
+)
+
+logger = logging.getLogger(__name__)
 
-def load_config() -> dict[str, Any] | None:
-    """加载配置文件。"""
-    try:
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            config = toml.load(f)
-        # 验证 download_credential 部分是否存在且包含必要项
-        download_cred = config.get('download_credential', {})
-        if not all(k in download_cred for k in ['sessdata', 'bili_jct', 'uid']):
-            print(f"错误：配置文件 {CONFIG_FILE} 缺少 [download_credential] 部分或其必要的 sessdata, bili_jct, uid 配置项。")
-            return None
-        # 验证必要项的值不为空
-        if not download_cred['sessdata'] or not download_cred['bili_jct'] or download_cred['uid'] == 0:
-            print(f"错误：配置文件 {CONFIG_FILE} 中 [download_credential] 的 sessdata, bili_jct 或 uid 不能为空或为0。请填充有效值。")
-            return None
-        print(f"成功从 {os.path.abspath(CONFIG_FILE)} 加载配置。")
-        return config
-    except FileNotFoundError:
-        print(f"错误：配置文件 {CONFIG_FILE} 未找到。请确保配置文件存在于脚本同级目录。")
-        return None
-    except toml.TomlDecodeError as e:
-        print(f"错误：解析配置文件 {CONFIG_FILE} 失败: {e}")
-        return None
-    except Exception as e:
-        print(f"加载配置文件时发生未知错误: {e}")
-        return None
+
+class IncompleteExportError(Exception):
+    """关注列表未能完整获取。"""
 
 
 async def get_all_followings(
-    uid: str | int, credential: Credential
-) -> list[dict[str, Any]]:
-    """获取用户的所有关注列表。
+    uid: str | int,
+    credential: Credential,
+    concurrency: int = 10,
+    limiter: RateLimiter | None = None,
+    max_retries: int = 3,
+    retry_interval: float = 5,
+) -> AsyncIterator[list[dict[str, Any]]]:
+    """逐页获取用户的所有关注列表。
+
+    先获取第一页以得知关注总数，再并发获取其余页面，并按页码顺序产出。
 
     Args:
+        uid (str | int): 用户的 UID。
         credential (Credential): 用户的认证凭证。
+        concurrency (int, optional): 同时请求的最大页数. Defaults to 10.
+        limiter (RateLimiter | None, optional): 请求限流器，为 None 时使用 30 次/10 秒. Defaults to None.
+        max_retries (int, optional): 单页获取失败时的最大重试次数. Defaults to 3.
+        retry_interval (float, optional): 非限流错误的重试等待时间（秒）. Defaults to 5.
 
-    Returns:
-        List[Dict[str, Any]]: 包含所有关注用户信息的列表。
+    Yields:
+        list[dict[str, Any]]: 每一页的关注用户信息列表。
+
+    Raises:
+        IncompleteExportError: 某一页重试后仍获取失败或返回为空时抛出，此时已产出的数据不完整。
     """
 
     # 重新实例化 User 以获取关注列表
     u = user.User(uid=int(uid), credential=credential)
-    followings: list[dict[str, Any]] = []
-    page_num = 1
-    while True:
-        try:
-            res = await u.get_followings(pn=page_num)
-            if not res or not res.get("list"):
+    if limiter is None:
+        limiter = RateLimiter(30, 10)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def _fetch(page_num: int) -> dict[str, Any]:
+        retries = 0
+        while True:
+            try:
+                async with sem:
+                    await limiter.acquire()
+                    res = await u.get_followings(pn=page_num)
+                # 第一页之后的页码由关注总数算出，返回空列表说明数据缺失，按失败重试
+                if page_num > 1 and not (res or {}).get("list"):
+                    raise IncompleteExportError("返回的关注列表为空")
                 break
-            followings.extend(res["list"])
-            print(f"已获取第 {page_num} 页关注列表，共 {len(res['list'])} 个用户...")
-            if len(followings) >= res.get("total", 0):
-                break
-            page_num += 1
-            await asyncio.sleep(1)  # 避免请求过快
-        except Exception as e:
-            print(f"获取关注列表时出错: {e}")
-            break
-    return followings
+            except Exception as e:
+                retries += 1
+                if retries > max_retries:
+                    raise IncompleteExportError(
+                        f"第 {page_num} 页在 {max_retries + 1} 次尝试后仍获取失败: {e}"
+                    ) from e
+                if isinstance(e, ResponseCodeException) and e.code in RATE_LIMIT_CODES:
+                    # 触发限流时暂停共享限流器，所有分页请求一起退避
+                    logger.warning(
+                        f"获取第 {page_num} 页时触发限流，所有请求将暂停 {RATE_LIMIT_DELAY} 秒..."
+                    )
+                    limiter.pause(RATE_LIMIT_DELAY)
+                else:
+                    logger.warning(
+                        f"获取第 {page_num} 页关注列表失败: {e}，将在 {retry_interval} 秒后重试..."
+                    )
+                    await asyncio.sleep(retry_interval)
+        res = res or {}
+        logger.info(
+            f"已获取第 {page_num} 页关注列表，共 {len(res.get('list') or [])} 个用户..."
+        )
+        return res
+
+    first = await _fetch(1)
+    if not first.get("list"):
+        return
+    yield first["list"]
 
+    total_pages = math.ceil(first.get("total", 0) / len(first["list"]))
+    tasks = [asyncio.create_task(_fetch(p)) for p in range(2, total_pages + 1)]
+    try:
+        # 按页码顺序等待，保证输出顺序与关注顺序一致
+        for task in tasks:
+            yield (await task)["list"]
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def save_followings_to_json(
+    pages: AsyncIterator[list[dict[str, Any]]], filename: str = "followings.json"
+) -> int | None:
+    """将逐页获取的关注列表以流式方式写入 JSON 文件。
 
-def save_followings_to_json(
-    followings: list[dict[str, Any]], filename: str = "followings.json"
-) -> None:
-    """将关注列表保存到 JSON 文件。
+    每获取一页即写入临时文件，无需在内存中缓存完整列表；全部写入成功后才替换目标文件，
+    获取中断时保留原有文件不变。没有任何数据时不会创建文件。
 
     Args:
-        followings (List[Dict[str, Any]]): 关注列表数据。
+        pages (AsyncIterator[list[dict[str, Any]]]): 逐页产出关注列表数据的异步迭代器。
         filename (str, optional): 保存的文件名. Defaults to "followings.json".
+
+    Returns:
+        int | None: 写入的关注用户数量，获取不完整或写入失败时返回 None。
     """
+    tmp_filename = f"{filename}.part"
+    count = 0
+    f = None
     try:
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(followings, f, ensure_ascii=False, indent=4)
-        print(f"关注列表已成功导出到 {os.path.abspath(filename)}")
+        # aclosing 保证写入出错时也会关闭生成器，从而取消尚未完成的分页请求
+        async with contextlib.aclosing(pages) as page_iter:
+            async for page in page_iter:
+                if not page:
+                    continue
+                # 文件操作放到线程中执行，避免阻塞仍在进行的分页请求
+                if f is None:
+                    f = await asyncio.to_thread(open, tmp_filename, "wb")
+                    sep = b"[\n"
+                else:
+                    sep = b",\n"
+                chunk = sep + b",\n".join(json_dumps(r) for r in page)
+                await asyncio.to_thread(f.write, chunk)
+                count += len(page)
+        if f is not None:
+            await asyncio.to_thread(f.write, b"\n]\n")
+            # close 会刷新缓冲区，同样放到线程中执行
+            await asyncio.to_thread(f.close)
+            f = None
+            await asyncio.to_thread(os.replace, tmp_filename, filename)
+            logger.info(f"关注列表已成功导出到 {os.path.abspath(filename)}")
+        return count
+    except IncompleteExportError as e:
+        logger.error(f"获取关注列表时出错，导出未完成: {e}")
     except IOError as e:
-        print(f"保存文件时出错: {e}")
+        logger.error(f"保存文件时出错: {e}")
+    finally:
+        if f is not None:
+            await asyncio.to_thread(f.close)
+            await asyncio.to_thread(os.remove, tmp_filename)
+    return None
 
 
 async def main() -> None:
-    """主函数，执行获取和导出关注列表的流程。"""
-    print("欢迎使用 Bilibili 关注列表导出工具！")
+    """主函数，在共享的 HTTP 会话中执行导出关注列表的流程。"""
+    # 每主机连接数与分页并发数保持一致
+    session = None
+    try:
+        session = await use_shared_session(limit_per_host=10)
+        await run_download()
+    finally:
+        if session is not None:
+            await session.close()
+
+
+async def run_download() -> None:
+    """执行获取和导出关注列表的流程。"""
+    logger.info("欢迎使用 Bilibili 关注列表导出工具！")
 
     # 加载配置
-    config = load_config()
+    config = await asyncio.to_thread(load_config, 'download_credential')
     if not config:
         return
 
@@ -111,29 +200,34 @@ async def main() -> None:
     # 实例化 Credential
     credential = Credential(sessdata=sessdata, bili_jct=bili_jct, buvid3=buvid3)
 
-    print("正在验证凭证并获取用户信息...")
+    logger.info("正在验证凭证并获取用户信息...")
     try:
         # 尝试获取用户信息以验证凭证有效性
         u_self = user.User(uid=int(uid), credential=credential)
         user_info = await u_self.get_user_info()
-        print(f"凭证有效，当前用户: {user_info.get('name', '未知')}")
+        logger.info(f"凭证有效，当前用户: {user_info.get('name', '未知')}")
     except Exception as e:
-        print(f"凭证无效或获取用户信息失败: {e}")
-        print("请检查您的 SESSDATA 和 bili_jct 是否正确且未过期。")
+        logger.error(f"凭证无效或获取用户信息失败: {e}")
+        logger.error("请检查您的 SESSDATA 和 bili_jct 是否正确且未过期。")
         return
 
-    print("开始获取关注列表...")
-    followings_list = await get_all_followings(uid, credential)
+    logger.info("开始获取关注列表...")
+    count = await save_followings_to_json(get_all_followings(uid, credential))
 
-    if followings_list:
-        print(f"共获取到 {len(followings_list)} 个关注用户。")
-        save_followings_to_json(followings_list)
+    if count is None:
+        logger.error("关注列表导出失败，原有的关注列表文件（如有）未被修改。")
+    elif count:
+        logger.info(f"共获取到 {count} 个关注用户。")
     else:
-        print("未能获取到关注列表，或关注列表为空。")
+        logger.warning("未能获取到关注列表，或关注列表为空。")
 
 
 if __name__ == "__main__":
-    # 使用 sync() 来运行异步的 main 函数
-    # 如果在不支持 top-level await 的环境或者需要兼容旧代码，可以使用 asyncio.run()
-    # 但 bilibili-api 推荐使用 sync()
-    sync(main())
+    log_listener = setup_logging()
+    try:
+        # 使用 sync() 来运行异步的 main 函数
+        # 如果在不支持 top-level await 的环境或者需要兼容旧代码，可以使用 asyncio.run()
+        # 但 bilibili-api 推荐使用 sync()
+        sync(main())
+    finally:
+        log_listener.stop()